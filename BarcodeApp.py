@@ -1,5 +1,6 @@
 import csv
 from datetime import datetime
+import io
 import os
 import sys
 import subprocess
@@ -21,6 +22,37 @@ except ImportError:
     ImageWriter = None
     barcode_available = False
 
+# --- Optional imaging imports ---
+try:
+    from PIL import Image, ImageWin
+
+    pil_available = True
+except ImportError:
+    Image = None
+    ImageWin = None
+    pil_available = False
+
+# --- Optional Windows printing imports ---
+win32print = win32ui = win32con = None
+if sys.platform == "win32":
+    try:
+        import win32print
+        import win32ui
+        import win32con
+    except ImportError:
+        pass
+
+if win32con is not None:
+    _HORZRES, _VERTRES = win32con.HORZRES, win32con.VERTRES
+else:
+    _HORZRES = _VERTRES = None
+
+# Resolve the barcode class once instead of on every render
+if barcode_available:
+    _CODE128 = barcode_module.get_barcode_class("code128")
+else:
+    _CODE128 = None
+
 # --- Constants ---
 # Create app data directory
 APP_NAME = "BarcodeApp"
@@ -34,10 +66,29 @@ APP_DATA_DIR.mkdir(parents=True, exist_ok=True)
 CSV_FILE = APP_DATA_DIR / "print_history.csv"
 CONFIG_FILE = APP_DATA_DIR / "config.json"
 
+# Size in pixels of the generated barcode label
+LABEL_SIZE = (600, 300)
+
+# Write buffer for print_history.csv so each write is flushed in one syscall
+HISTORY_BUFFER_SIZE = 64 * 1024
+
+# Header row of print_history.csv, as csv.writer would write it
+_HISTORY_HEADER = "barcode,date time printed\r\n"
+
+# Stat print_history.csv once per run; refreshed after each write to it
+try:
+    _history_stat = CSV_FILE.stat()
+except FileNotFoundError:
+    _history_stat = None
+
+# Whether print_history.csv already has its header row
+_history_header_written = _history_stat is not None and _history_stat.st_size > 0
+
 
 # --- Function definitions ---
+@st.cache_data(ttl=None, show_spinner=False)
 def load_config():
-    """Load configuration from JSON file"""
+    """Load configuration from JSON file (cached until cleared)"""
     default_config = {"last_printer": None, "auto_print_enabled": True}
     try:
         if CONFIG_FILE.exists():
@@ -59,21 +110,20 @@ def save_config(config_data):
         pass  # Silently fail if we can't save config
 
 
+@st.cache_data(ttl=60, show_spinner=False)
 def get_printer_names():
     """
     Returns a list of printer names available on the OS.
     Works on Windows using win32print.
+    Cached for a minute so reruns don't re-enumerate printers.
     """
     if sys.platform == "win32":
-        try:
-            import win32print
-
-            printers = win32print.EnumPrinters(
-                win32print.PRINTER_ENUM_LOCAL | win32print.PRINTER_ENUM_CONNECTIONS
-            )
-            return [printer[2] for printer in printers]
-        except ImportError:
+        if win32print is None:
             return ["win32print module not installed"]
+        printers = win32print.EnumPrinters(
+            win32print.PRINTER_ENUM_LOCAL | win32print.PRINTER_ENUM_CONNECTIONS
+        )
+        return [printer[2] for printer in printers]
     else:
         # For non-Windows, try using lpstat if available
         try:
@@ -83,123 +133,251 @@ def get_printer_names():
             return ["Printer listing not supported on this OS"]
 
 
+def label_writer_options(code):
+    """
+    Returns ImageWriter options that render the barcode already centered on a LABEL_SIZE label.
+    The padding goes into the quiet zone and top/bottom margins, so no blank label or paste is needed.
+    Barcodes too large for the label are rendered at their natural size.
+    """
+    # Start from python-barcode's Code128 defaults (module width and quiet zone in mm)
+    options = {
+        **code.default_writer_options,
+        "module_width": 0.2,
+        "quiet_zone": 2.54,
+        "text": code.get_fullcode(),
+    }
+    writer = code.writer
+    writer.set_options(options)
+    width_mm, height_mm = writer.calculate_size(len(code.build()[0]), 1)
+    # Aim half a pixel over the target since ImageWriter truncates to whole pixels
+    target_width_mm, target_height_mm = (
+        (pixels + 0.5) * 25.4 / writer.dpi for pixels in LABEL_SIZE
+    )
+    extra_width_mm = max(target_width_mm - width_mm, 0)
+    extra_height_mm = max(target_height_mm - height_mm, 0)
+    options["quiet_zone"] += extra_width_mm / 2
+    options["margin_top"] = writer.margin_top + extra_height_mm / 2
+    options["margin_bottom"] = writer.margin_bottom + extra_height_mm / 2
+    return options
+
+
+@st.cache_data(show_spinner=False, max_entries=256, ttl=3600)
 def generate_barcode(barcode_data):
     """
-    Generates a barcode image from the given data and returns the PIL Image object.
-    Returns the Image object if successful, else None.
+    Generates a barcode image from the given data.
+    Returns a (PIL Image, None) tuple if successful, else (None, error message).
+    Results are cached so reprints of the same barcode skip re-rendering.
     """
-    if not barcode_available or barcode_module is None or ImageWriter is None:
-        st.error(
-            "Required barcode libraries are not installed. Please install: pip install python-barcode[images]"
+    if not barcode_available or not pil_available:
+        return (
+            None,
+            "Required barcode libraries are not installed. Please install: pip install python-barcode[images]",
         )
-        return None
     try:
-        from PIL import Image
-        import io
-
-        # Use Code128 for general barcode support
-        CODE128 = barcode_module.get_barcode_class("code128")
-        code = CODE128(barcode_data, writer=ImageWriter())
+        # Use Code128 for general barcode support.
+        # ImageWriter keeps per-render state, so it isn't shared between calls.
+        code = _CODE128(barcode_data, writer=ImageWriter())
         with io.BytesIO() as buffer:
-            code.write(buffer)
+            # Render straight at label size instead of pasting onto a blank label
+            code.write(buffer, options=label_writer_options(code))
             buffer.seek(0)
-            barcode_img = Image.open(buffer)
-            # Create a white label and center the barcode on it
-            label_width, label_height = 600, 300
-            label_img = Image.new("RGB", (label_width, label_height), 0xFFFFFF)
-            barcode_x = (label_width - barcode_img.width) // 2
-            barcode_y = (label_height - barcode_img.height) // 2
-            label_img.paste(barcode_img, (barcode_x, barcode_y))
-            return label_img
+            label_img = Image.open(buffer).convert("RGB")
+            return label_img, None
     except Exception as e:
-        st.error(f"Barcode generation failed: {e}")
-        return None
+        return None, f"Barcode generation failed: {e}"
+
+
+def label_print_rect(image_obj, printable_area):
+    """
+    Returns the (left, top, right, bottom) rect that fits the label in the printable area,
+    centered and keeping its aspect ratio. GDI stretches the label into it when drawing.
+    """
+    img_width, img_height = image_obj.size
+    scale = min(printable_area[0] / img_width, printable_area[1] / img_height)
+    scaled_width = int(img_width * scale)
+    scaled_height = int(img_height * scale)
+    x = int((printable_area[0] - scaled_width) / 2)
+    y = int((printable_area[1] - scaled_height) / 2)
+    return x, y, x + scaled_width, y + scaled_height
 
 
 def print_barcode_image(image_obj, printer_name):
     """
     Sends the barcode image to the specified printer (Windows only) using direct GDI printing with Pillow and ImageWin.
+    Logs the print to history. Returns True if the print was sent.
+    """
+    if not print_barcode_images_batch([image_obj], printer_name):
+        return False
+    st.success(f"Sent barcode to printer: {printer_name}")
+
+    # Log print history
+    log_print_history()
+    return True
+
+
+def print_barcode_images_batch(images, printer_name):
+    """
+    Sends the barcode images to the specified printer (Windows only) as one print job, one image per page.
+    The printer DC is created once for the whole batch. Returns True if the job was sent.
     """
     if sys.platform != "win32":
         st.error("Printing is only supported on Windows.")
-        return
-    try:
-        import win32ui
-        from PIL import ImageWin
-        import win32con
-
-        # Use the provided image object
-        img = image_obj
-        hDC = win32ui.CreateDC()
-        hDC.CreatePrinterDC(printer_name)
-        printable_area = hDC.GetDeviceCaps(win32con.HORZRES), hDC.GetDeviceCaps(
-            win32con.VERTRES
+        return False
+    if win32ui is None or win32con is None or not pil_available:
+        st.error(
+            "Required printing libraries are not installed. Please install: pip install pywin32 Pillow"
         )
-        img_width, img_height = img.size
-        scale = min(printable_area[0] / img_width, printable_area[1] / img_height)
-        scaled_width = int(img_width * scale)
-        scaled_height = int(img_height * scale)
-        img = img.resize((scaled_width, scaled_height))
-        hDC.StartDoc("Barcode Print")
-        hDC.StartPage()
-        dib = ImageWin.Dib(img)
-        x = int((printable_area[0] - scaled_width) / 2)
-        y = int((printable_area[1] - scaled_height) / 2)
-        dib.draw(hDC.GetHandleOutput(), (x, y, x + scaled_width, y + scaled_height))
-        hDC.EndPage()
+        return False
+    hDC = None
+    try:
+        printer_dc = win32ui.CreateDC()
+        printer_dc.CreatePrinterDC(printer_name)
+        # Only delete the DC once it is attached to the printer
+        hDC = printer_dc
+        printable_area = hDC.GetDeviceCaps(_HORZRES), hDC.GetDeviceCaps(_VERTRES)
+        hDC.StartDoc("Barcode Print" if len(images) == 1 else "Barcode Print Batch")
+        try:
+            for image_obj in images:
+                hDC.StartPage()
+                # Draw the label unscaled; GDI stretches it to the printer resolution
+                dib = ImageWin.Dib(image_obj)
+                dib.draw(
+                    hDC.GetHandleOutput(), label_print_rect(image_obj, printable_area)
+                )
+                hDC.EndPage()
+        except Exception:
+            # Cancel the half-spooled job rather than printing a partial batch
+            hDC.AbortDoc()
+            raise
         hDC.EndDoc()
-        hDC.DeleteDC()
-        st.success(f"Sent barcode to printer: {printer_name}")
-
-        # Log print history
-        log_print_history()
+        return True
     except Exception as e:
         st.error(f"Printing failed: {e}")
+        return False
+    finally:
+        if hDC is not None:
+            hDC.DeleteDC()
 
 
 # --- Print history logging ---
+def _fmt_now():
+    """
+    Returns the current time as "%m/%d/%Y %I:%M %p" without going through strftime.
+    """
+    now = datetime.now()
+    hour = (now.hour - 1) % 12 + 1
+    meridiem = "AM" if now.hour < 12 else "PM"
+    return f"{now.month:02d}/{now.day:02d}/{now.year} {hour:02d}:{now.minute:02d} {meridiem}"
+
+
+def refresh_history_stat():
+    """
+    Re-stats print_history.csv after a write and updates the header flag to match.
+    """
+    global _history_stat, _history_header_written
+    try:
+        _history_stat = CSV_FILE.stat()
+    except FileNotFoundError:
+        _history_stat = None
+    _history_header_written = _history_stat is not None and _history_stat.st_size > 0
+
+
 def log_print_history():
     """
     Appends a print record to print_history.csv with columns: barcode, date time printed
     """
     global input_barcode
     barcode_value = input_barcode if "input_barcode" in globals() else ""
-    now = datetime.now().strftime("%m/%d/%Y %I:%M %p")
-    write_header = False
-    try:
-        with open(CSV_FILE, "r", newline="", encoding="utf-8") as history_file:
-            pass
-    except FileNotFoundError:
-        write_header = True
-    with open(CSV_FILE, "a", newline="", encoding="utf-8") as history_file:
+    log_print_history_bulk([barcode_value])
+
+
+def log_print_history_bulk(barcodes):
+    """
+    Appends one print record per barcode to print_history.csv using a single file open.
+    All records share the same timestamp.
+    """
+    now = _fmt_now()
+    with open(
+        CSV_FILE, "a", newline="", encoding="utf-8", buffering=HISTORY_BUFFER_SIZE
+    ) as history_file:
+        if not _history_header_written:
+            history_file.write(_HISTORY_HEADER)
         csv_writer = csv.writer(history_file)
-        if write_header:
-            csv_writer.writerow(["barcode", "date time printed"])
-        csv_writer.writerow([barcode_value, now])
+        csv_writer.writerows([(barcode_value, now) for barcode_value in barcodes])
+    refresh_history_stat()
+    # Drop stale cached history; the next read is keyed on the new mtime anyway
+    load_history.clear()
+
+
+@st.cache_data(show_spinner=False)
+def load_history(mtime, size):
+    """
+    Loads print_history.csv sorted newest first.
+    mtime and size are only used as the cache key so the file is re-parsed only when it changes.
+    """
+    history_df = pd.read_csv(CSV_FILE, dtype={"barcode": "string"})
+    # Sort on parsed timestamps; the "%m/%d/%Y" strings don't sort chronologically
+    history_df["_ts"] = pd.to_datetime(
+        history_df["date time printed"],
+        format="%m/%d/%Y %I:%M %p",
+        errors="coerce",
+        cache=True,
+    )
+    # Minute-resolution timestamps tie often (reprint batches share one), so use a
+    # stable sort on the reversed file to keep the most recently written row first
+    history_df = history_df.iloc[::-1].sort_values(
+        by="_ts", ascending=False, kind="stable"
+    )
+    return history_df.drop(columns="_ts")
 
 
 # --- Streamlit UI and logic ---
 st.title("Barcode Printer")
 
-# Load configuration
-config = load_config()
+# Load configuration once per session
+if "config" not in st.session_state:
+    st.session_state.config = load_config()
 
-# Get available printers
-available_printers = get_printer_names()
+# Let the user re-enumerate printers (e.g. after plugging one in)
+if st.sidebar.button("Refresh printers", use_container_width=True):
+    get_printer_names.clear()
+    st.session_state.pop("printers", None)
 
-# Set default printer selection
-default_printer_index = 0
-if config["last_printer"] and config["last_printer"] in available_printers:
-    default_printer_index = available_printers.index(config["last_printer"])
+# Get available printers once per session
+if "printers" not in st.session_state:
+    st.session_state.printers = get_printer_names()
+
+
+@st.fragment
+def render_printer_select():
+    """
+    Draws the printer selectbox. Runs as a fragment so changing printers doesn't rerun the whole app.
+    The selection is kept in st.session_state.selected_printer.
+    """
+    config = st.session_state.config
+    available_printers = st.session_state.printers
+
+    # Set default printer selection
+    default_printer_index = 0
+    if config["last_printer"] and config["last_printer"] in available_printers:
+        default_printer_index = available_printers.index(config["last_printer"])
+
+    select_printer = st.selectbox(
+        "Select a printer:",
+        available_printers,
+        index=default_printer_index,
+        key="selected_printer",
+    )
+
+    # Save selected printer to config when it changes
+    if select_printer != config["last_printer"]:
+        config["last_printer"] = select_printer
+        save_config(config)
+        load_config.clear()
 
-select_printer = st.selectbox(
-    "Select a printer:", available_printers, index=default_printer_index
-)
 
-# Save selected printer to config when it changes
-if select_printer != config["last_printer"]:
-    config["last_printer"] = select_printer
-    save_config(config)
+render_printer_select()
+select_printer = st.session_state.selected_printer
 
 # Initialize session state for tracking input changes
 if "previous_barcode" not in st.session_state:
@@ -226,43 +404,64 @@ if (
 # Generate and display barcode image if input is provided
 barcode_image = None
 if input_barcode:
-    barcode_image = generate_barcode(input_barcode)
+    barcode_image, barcode_error = generate_barcode(input_barcode)
+    if barcode_error:
+        st.error(barcode_error)
     if barcode_image:
         # with col2:
         st.image(barcode_image, caption="Generated Barcode", use_container_width=True)
 
-# Auto-print when Enter is pressed
-if auto_print:
-    if input_barcode and input_barcode.strip():
-        # Regenerate barcode to ensure latest input is printed
-        barcode_image = generate_barcode(input_barcode)
-        if barcode_image:
-            print_barcode_image(barcode_image, select_printer)
-    else:
-        st.warning("Please enter a barcode before printing.")
+# Auto-print when Enter is pressed, reusing the image displayed above
+if auto_print and barcode_image:
+    print_barcode_image(barcode_image, select_printer)
 
 
 # Button to clear print history CSV
 if col2.button("Clear Print History", type="secondary", use_container_width=True):
-    with open(CSV_FILE, "w", encoding="utf-8", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(["barcode", "date time printed"])
+    CSV_FILE.write_text(_HISTORY_HEADER, encoding="utf-8", newline="")
+    refresh_history_stat()
+    load_history.clear()
     st.success("Print history cleared.")
 
-# Ensure print_history.csv exists with header before reading
-if not os.path.exists(CSV_FILE):
-    with open(CSV_FILE, "w", encoding="utf-8", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(["barcode", "date time printed"])
 
-df = pd.read_csv(CSV_FILE)
-df = df.sort_values(by="date time printed", ascending=False)
+@st.fragment
+def render_history():
+    """
+    Draws the print history table and reprint controls. Call inside `with st.sidebar:`.
+    Runs as a fragment so selecting rows or reprinting doesn't rerun the whole app.
+    """
+    # Fragment reruns skip the top-level stat, so take a fresh one here to pick up
+    # rows written since the last full run (e.g. by another session)
+    refresh_history_stat()
+
+    # Ensure print_history.csv exists with header before reading
+    if not _history_header_written:
+        CSV_FILE.write_text(_HISTORY_HEADER, encoding="utf-8", newline="")
+        refresh_history_stat()
+
+    # Skip pandas entirely when the file holds only the header
+    if _history_stat.st_size <= len(_HISTORY_HEADER):
+        df = pd.DataFrame(columns=["barcode", "date time printed"])
+    else:
+        df = load_history(_history_stat.st_mtime, _history_stat.st_size)
+
+    st.header("Print History")
 
-st.sidebar.header("Print History")
+    # Show the result of a reprint from the previous fragment run
+    if "reprint_message" in st.session_state:
+        reprint_message, reprint_skipped = st.session_state.pop("reprint_message")
+        if reprint_skipped:
+            st.warning(reprint_message)
+        else:
+            st.success(reprint_message)
 
-# Add selection capability to the dataframe
-if not df.empty:
-    selected_rows = st.sidebar.dataframe(
+    if df.empty:
+        st.dataframe(df, use_container_width=True, hide_index=True)
+        st.write("No print history available")
+        return
+
+    # Add selection capability to the dataframe
+    selected_rows = st.dataframe(
         df,
         use_container_width=True,
         hide_index=True,
@@ -275,25 +474,53 @@ if not df.empty:
     if "selection" in selected_rows and "rows" in selected_rows["selection"]:
         selected_indices = selected_rows["selection"]["rows"]
         if selected_indices:
-            selected_barcodes = df.iloc[selected_indices]["barcode"].tolist()
-            selected_rows_list = selected_barcodes
+            # Skip empty barcodes and print each unique barcode only once
+            # (stripping is only used to spot blanks; spaces are valid in Code128)
+            selected_barcodes = (
+                df["barcode"].iloc[selected_indices].dropna().astype(str)
+            )
+            selected_rows_list = (
+                selected_barcodes[selected_barcodes.str.strip() != ""]
+                .drop_duplicates()
+                .tolist()
+            )
 
     if selected_rows_list:
-        st.sidebar.write(f"Selected {len(selected_rows_list)} item(s) for reprinting:")
+        st.write(f"Selected {len(selected_rows_list)} item(s) for reprinting:")
         for barcode in selected_rows_list:
-            st.sidebar.write(f"• {barcode}")
+            st.write(f"• {barcode}")
 
-        if st.sidebar.button(
-            "Reprint Selected", type="primary", use_container_width=True
-        ):
+        if st.button("Reprint Selected", type="primary", use_container_width=True):
+            reprint_barcodes = []
+            reprint_images = []
+            reprint_errors = []
             for barcode in selected_rows_list:
-                if barcode and barcode.strip():  # Skip empty barcodes
-                    reprint_image = generate_barcode(barcode)
-                    if reprint_image:
-                        print_barcode_image(reprint_image, select_printer)
-            st.sidebar.success(
-                f"Reprinted {len([b for b in selected_rows_list if b and b.strip()])} barcode(s)"
-            )
-else:
-    st.sidebar.dataframe(df, use_container_width=True, hide_index=True)
-    st.sidebar.write("No print history available")
+                reprint_image, reprint_error = generate_barcode(barcode)
+                if reprint_error:
+                    st.error(reprint_error)
+                    reprint_errors.append(f"{barcode}: {reprint_error}")
+                if reprint_image:
+                    reprint_barcodes.append(barcode)
+                    reprint_images.append(reprint_image)
+            # Print all reprints as one job and log them with a single write
+            if reprint_images and print_barcode_images_batch(
+                reprint_images, st.session_state.selected_printer
+            ):
+                log_print_history_bulk(reprint_barcodes)
+                # Rerun just this fragment so the new rows show up; keep any
+                # generation failures in the message since the rerun clears st.error
+                reprint_message = f"Reprinted {len(reprint_barcodes)} barcode(s)"
+                if reprint_errors:
+                    reprint_message += (
+                        f", skipped {len(reprint_errors)}:\n\n"
+                        + "\n".join(f"- {error}" for error in reprint_errors)
+                    )
+                st.session_state.reprint_message = (
+                    reprint_message,
+                    bool(reprint_errors),
+                )
+                st.rerun(scope="fragment")
+
+
+with st.sidebar:
+    render_history()